@@ -0,0 +1,109 @@
+# crewai_bomb/config.py
+import asyncio
+import functools
+import json
+import os
+import re
+from typing import Optional, Tuple
+
+import httpx
+import openai
+from crewai import LLM
+
+from crewai_bomb.llm import StreamingGeminiLLM
+
+try:  # Optional: a libuv-based event loop, faster on this I/O-bound loop (winloop is its Windows port)
+    import uvloop
+except ImportError:
+    try:
+        import winloop as uvloop
+    except ImportError:
+        uvloop = None
+
+# Default model name - can be overridden by environment variable or specific calls
+GEMINI_MODEL_NAME = "gemini-2.0-flash"  # Standard model name for Gemini Flash
+
+# The pooled HTTP client of the local command LLM, closed by close_local_command_llm()
+_local_command_http_client: Optional[httpx.Client] = None
+
+
+def install_event_loop_policy() -> None:
+    """
+    Makes asyncio.run() use uvloop (or winloop) if it is installed. Call it before asyncio.run().
+    """
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+@functools.lru_cache(maxsize=1)
+def get_gemini_key() -> Optional[str]:
+    """
+    Returns the Gemini API key from gemini_API_key.json, or the GEMINI_API_KEY environment variable
+    if the file does not exist or is not valid JSON. The key is only read once per process.
+    """
+    try:
+        with open("gemini_API_key.json", "r") as f:
+            return json.load(f).get("api_key")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return os.getenv("GEMINI_API_KEY")
+
+
+@functools.lru_cache(maxsize=None)
+def get_llm(
+        gemini_api_key: str,
+        temperature: float = 0.5,
+        top_p: Optional[float] = 0.8,
+        max_tokens: Optional[int] = None,
+        stop: Optional[Tuple[str, ...]] = None,
+        early_stop_pattern: Optional[re.Pattern] = None
+) -> LLM:
+    """
+    Returns the shared LLM for the given API key and sampling parameters, creating it on first use.
+    Every crew built in this process uses the same instance (and so the same Gemini client).
+    """
+    return StreamingGeminiLLM(
+        model=GEMINI_MODEL_NAME,
+        api_key=gemini_api_key,
+        temperature=temperature,
+        top_p=top_p,
+        top_k=20,
+        max_tokens=max_tokens,
+        stop=list(stop) if stop else None,
+        early_stop_pattern=early_stop_pattern,
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def get_local_command_llm() -> Optional[LLM]:
+    """
+    Returns the local LLM set up with LOCAL_COMMAND_LLM_URL (an OpenAI-compatible server, e.g.
+    llama.cpp serving a small quantized model) and LOCAL_COMMAND_LLM_MODEL, or None if it is not set.
+    """
+    global _local_command_http_client
+    base_url = os.getenv("LOCAL_COMMAND_LLM_URL")
+    if not base_url:
+        return None
+    # A pooled, keep-alive HTTP client for this LLM only - litellm's process-wide client_session is left alone
+    _local_command_http_client = httpx.Client(
+        limits=httpx.Limits(max_keepalive_connections=16, max_connections=64)
+    )
+    return LLM(
+        model=os.getenv("LOCAL_COMMAND_LLM_MODEL", "openai/qwen2.5-0.5b-instruct-q4_k_m"),
+        base_url=base_url,
+        api_key="none",
+        temperature=0.0,
+        max_tokens=32,
+        # Passed through to litellm, which sends the requests with this client instead of creating one
+        client=openai.OpenAI(base_url=base_url, api_key="none", http_client=_local_command_http_client),
+    )
+
+
+def close_local_command_llm() -> None:
+    """
+    Closes the HTTP client of the local command LLM. A later get_local_command_llm() creates a new LLM and client.
+    """
+    global _local_command_http_client
+    if _local_command_http_client is not None:
+        _local_command_http_client.close()
+        _local_command_http_client = None
+    get_local_command_llm.cache_clear()
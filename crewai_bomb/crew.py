@@ -1,154 +1,118 @@
+import asyncio
 import json
 import os
-from typing import Dict, Any
+import re
+import shelve
+import threading
+from collections import deque
+from contextlib import AsyncExitStack
+from typing import Dict, Any, Deque, Final, List, Literal, Optional, Tuple
 
 from crewai import Agent, Task, Crew, Process, LLM
-from langchain_google_genai import ChatGoogleGenerativeAI
+from crewai.tasks.task_output import TaskOutput
+from pydantic import BaseModel
 
+from crewai_bomb.config import (
+    GEMINI_MODEL_NAME, close_local_command_llm, get_gemini_key, get_llm, get_local_command_llm,
+    install_event_loop_policy
+)
 # Import your custom tools
-from crewai_bomb.tools import DefuserTool, ExpertTool
+from crewai_bomb.tools import DefuserTool, ExpertTool, ToolCache, kickoff_abandoned
 
 # Import game clients
-from game_mcp.game_client import Defuser as DefuserClient, Expert as ExpertClient
+from game_mcp.game_client import GAME_OVER_RE, Defuser as DefuserClient, Expert as ExpertClient
 
-# Default model name - can be overridden by environment variable or specific calls
-GEMINI_MODEL_NAME = "gemini-2.0-flash"  # Standard model name for Gemini Flash
+# Stop generating at a role switch instead of running to the end of the token budget
+ROLE_STOP_SEQUENCES = ["\nDefuser:", "\nExpert:"]
 
-async def create_bomb_defusal_crew(server_url: str, gemini_api_key: str) -> Dict[str, Any]:
-    """
-    Creates and configures the Bomb Defusal Crew with Defuser and Expert agents.
+# A Defuser command inside the Expert's instruction, as accepted by the game server
+_VERB_RE = re.compile(
+    r"\b(cut wire \d+|press position \d+|press (?:red|blue|green|yellow)|release on \d+|(?:press|hold)(?!\s+\w))\b",
+    re.IGNORECASE,
+)
 
-    Args:
-        server_url: The URL of the bomb defusal game server.
-        gemini_api_key: The API key for Google Gemini.
+# The line completing an Expert or fused-round answer ('Final Answer: ...' or 'COMMAND: ...').
+# Their LLM stops streaming once it is generated - the rest of the answer is never used.
+_ANSWER_LINE_RE = re.compile(r"^\W*(?:Final Answer|COMMAND):[^\n]*\w[^\n]*\n", re.IGNORECASE | re.MULTILINE)
 
-    Returns:
-        A dictionary containing the configured "crew", "defuser_client", and "expert_client".
-    """
+# Prompt size limit of a fused round, in tokens. Older history is left out of prompts that would exceed it.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
 
-    # 1. Initialize the LLM
-    llm = LLM(
-        model=f"gemini/{GEMINI_MODEL_NAME}",  # specifies Gemini 2.0 Flash model
-        api_key=gemini_api_key,
-        provider="gemini/",
-        config={'temperature': 0.5, 'top_p': 0.8, 'top_k': 20}
+# Detail of the "timeout" RoundResult of a crew kickoff that did not finish within its deadline
+CREW_TIMEOUT_RESULT = "TIMEOUT: The crew did not finish within the deadline."
+# Detail of the RoundResult of a crew kickoff during which the game ended (e.g. by an action of the single-agent crew)
+CREW_GAME_OVER_RESULT = "GAME OVER: The game ended during the crew kickoff."
 
-    )
-    print(f"Using LLM: {GEMINI_MODEL_NAME}")
+# Returned by _kickoff_with_deadline instead of the result of a kickoff it gave up on
+KICKOFF_TIMED_OUT: Final = object()
+KICKOFF_GAME_OVER: Final = object()
 
-    # 2. Create and connect game clients for the tools
-    defuser_game_client = DefuserClient()
-    expert_game_client = ExpertClient()
+# The 'COMMAND: <command>' line closing a fused round's answer
+_COMMAND_LINE_RE = re.compile(r"^\W*COMMAND:\W*(.+?)\W*$", re.IGNORECASE | re.MULTILINE)
 
-    print(f"Connecting DefuserClient to {server_url}...")
-    await defuser_game_client.connect_to_server(server_url)
-    print(f"Connecting ExpertClient to {server_url}...")
-    await expert_game_client.connect_to_server(server_url)
-    print("Game clients connected.")
+# The type of the current module, recognized by the first line specific to its state
+_MODULE_RE = re.compile(
+    r"^(?:(?P<wires>Wires:)|(?P<button>Button:)|(?P<memory>Display shows:)"
+    r"|(?P<simon>Simon show|Continue the sequence))",
+    re.MULTILINE,
+)
 
-    # 3. Instantiate tools with the connected clients
-    defuser_action_tool = DefuserTool(server_url = server_url)
-    expert_manual_tool = ExpertTool(server_url = server_url)
-    print("Crew tools instantiated.")
+# Manual text per module type. Manuals do not depend on the bomb, so they are valid across games.
+_manual_cache: Dict[str, str] = {}
 
-    # 4. Define Agents
-    defuser_agent = Agent(
-        role="Defuser",
-        goal=(
-            "Interface with a live bomb. YOU MUST use tools to get the bomb's current state, "
-            "accurately describe this OBSERVED state to the Expert, and then precisely execute the Expert's "
-            "instructions using tools. Your actions directly determine success or failure."
-        ),
-        backstory=(
-            "You are a highly trained field operative. You are at the bomb site. "
-            "You DO NOT have prior knowledge of the bomb's state before each observation. "
-            "YOU MUST WAIT FOR THE RESULT OF THE TOOL CALL BEFORE PROCEEDING. "
-            "THE BOMB STATE CHANGES FROM OBSERVATION TO OBSERVATION. "
-            "You rely on your tools for observation and action, and a remote Expert for defusal knowledge. "
-            "Clarity in your descriptions (based ONLY on tool output) and precision in your actions are paramount. Failure is not an option."
-        ),
-        llm=llm,
-        tools=[defuser_action_tool],
-        verbose=True,
-        allow_delegation=False,
-        # memory = False,
-        cache = False,
-    )
+# Modules whose correct command is a pure function of their displayed state (memory depends on earlier stages)
+_DETERMINISTIC_MODULES = frozenset({"wires", "button"})
 
-    expert_agent = Agent(
-        # ... (expert_agent definition remains the same) ...
-        role="Expert",
-        goal=(
-            "Receive and interpret bomb descriptions from the Defuser. "
-            "Utilize the bomb manual to identify the correct procedures. "
-            "Provide clear, concise, and actionable single-step instructions to the Defuser. "
-            "Ensure instructions are unambiguous and lead towards successful defusal."
-        ),
-        backstory=(
-            "You are a master of explosive ordnance disposal (EOD) procedures, possessing "
-            "encyclopedic knowledge of various bomb mechanisms via manuals. "
-            "You operate remotely, relying solely on the Defuser's reports. "
-            "Your analytical skills and ability to provide precise guidance are critical "
-            "to saving the day."
-        ),
-        llm=llm,
-        tools=[expert_manual_tool],
-        verbose=True,
-        allow_delegation=False,
-        cache = False,
-    )
-    print("Crew agents defined.")
+# Server response to a command that moved the game forward
+_ADVANCED_RE = re.compile(r"module state has changed|SUCCESSFULLY DISARMED", re.IGNORECASE)
 
-    # 5. Define Tasks
-    task_observe_and_describe = Task(
-        description=(
-            "DEFUSER, YOUR IMMEDIATE AND CRITICAL TASK IS TO ASSESS THE BOMB AND REPORT ITS STATE TO THE EXPERT. "
-            "YOU CURRENTLY HAVE NO INFORMATION ABOUT THE BOMB'S STATE. YOU MUST NOT GUESS OR RECALL ANY PREVIOUS STATE. "
-            "FOLLOW THESE STEPS IMPERATIVELY AND IN THE SPECIFIED ORDER:\n"
-            "1. INVOKE TOOL TO GET RAW DATA: YOU MUST IMMEDIATELY use your 'DefuserActionTool' with the exact command 'state'. "
-            "THIS IS YOUR FIRST AND ABSOLUTELY MANDATORY ACTION. This tool call will return the 'raw_bomb_status'. "
-            "DO NOT PROCEED WITHOUT SUCCESSFULLY EXECUTING THIS TOOL CALL AND OBTAINING THE 'raw_bomb_status'.\n"
-            "DO NOT USE ANY OTHER COMMAND THAN 'state'."
-            "2. ANALYZE 'raw_bomb_status' FOR GAME END: Once the 'DefuserActionTool' returns the 'raw_bomb_status', YOU MUST EXAMINE IT. "
-            "If, AND ONLY IF, the 'raw_bomb_status' explicitly states the bomb is 'disarmed' or 'exploded' (or similar definitive game-ending phrases like 'BOOM!'), "
-            "YOU MUST report this game over condition. Your report MUST include the FULL, UNMODIFIED 'raw_bomb_status' as evidence. "
-            "DO NOT declare game over under any other circumstances.\n"
-            "3. GENERATE DESCRIPTION FOR EXPERT (IF GAME IS ONGOING): If the 'raw_bomb_status' does NOT indicate the game is over, "
-            "YOU MUST then generate a detailed, factual description of the bomb's current appearance and components. "
-            "Focus on details that would be relevant for identifying the module and its components "
-            "based on a manual. For example, mention the number of wires and their colors, serial number, "
-            "any symbols, numbers, button labels, or the sequence of flashing lights. "
-            "Be factual and descriptive."
-            "Describe everything you see and know about the bomb -- all the details."
-            "In particular, you should describe all the numbers you can see such as stage number."
-            "Do not say anything else -- just the information in the bomb state. "
-            "This description MUST BE BASED SOLELY AND ENTIRELY ON THE 'raw_bomb_status' YOU JUST OBTAINED FROM THE 'DefuserActionTool' IN STEP 1. "
-            "Focus on observable details critical for defusal (e.g., wire colors, numbers on wires, button labels, module types, displayed symbols or numbers, active lights). "
-            "BE PRECISE, THOROUGH, AND OBJECTIVE. DO NOT ADD ANY INTERPRETATIONS, ASSUMPTIONS, OR INFORMATION NOT DIRECTLY PRESENT IN THE 'raw_bomb_status'."
-            "YOU SHOULD ALSO DESCRIBE ALL THE PROVIDED COMMANDS."),
-        agent=defuser_agent,
-        expected_output=(
-            "EITHER: A highly detailed and factual description of the bomb's current state, explicitly stated as being derived *directly* from the 'raw_bomb_status' obtained via the 'DefuserActionTool'. The description must only contain information present in the tool's output.\n"
-            "OR: A definitive game over statement (e.g., 'GAME OVER: Bomb Disarmed as per server response.' or 'GAME OVER: Bomb Exploded as per server response.') which MUST include the complete, verbatim 'raw_bomb_status' received from the server."
-        ),
-    )
+# Commands that moved a deterministic module forward, keyed by module type and normalized state.
+# Loaded on first use from the shelve at COMMAND_CACHE_PATH (if set), so evaluation runs share it.
+_command_cache: Optional[Dict[str, str]] = None
 
-    task_expert_instruct = Task(
-        # ... (task_expert_instruct definition can remain largely the same, but ensure it emphasizes using the Defuser's *latest* report)
-        description=(
-            "EXPERT, THE DEFUSER HAS PROVIDED AN UPDATE WHICH IS SUPPOSEDLY BASED ON A FRESH OBSERVATION. YOUR TASK IS TO PROVIDE A SINGLE, ACTIONABLE INSTRUCTION. EXECUTE THESE STEPS:\n"
-            "1. SCRUTINIZE the Defuser's report. If the report indicates the game is over (disarmed/exploded), YOU MUST simply acknowledge this fact. NO FURTHER ACTION IS NEEDED.\n"
-            "2. IF THE GAME IS ONGOING: YOU MUST use your 'ExpertManualTool' IMMEDIATELY. Use the Defuser's LATEST provided description as the SOLE basis for your query to the manual. DO NOT rely on any previous information.\n"
-            "FIRST USE THE MANUAL AND THEN REASON ABOUT YOUR OUTPUT"
-            "3. BASED ON THE MANUAL AND THE DEFUSER'S LATEST DESCRIPTION, YOU MUST FORMULATE EXACTLY ONE, CLEAR, UNAMBIGUOUS, AND ACTIONABLE INSTRUCTION for the Defuser. "
-            "This instruction MUST be a command the Defuser can directly execute with their tool (e.g., 'cut wire 3', 'press red'). "
-            "DO NOT provide explanations, dialogues, or multiple options. ONE. SINGLE. COMMAND."
-            "YOUR COMMAND MUST BE ONE OF THE COMMAND PROVIDED BY THE DEFUSER."
-
-            f"""
-                **Reasoning:**  Reason about your action.
-                **Single Action:** Provide only one action. The Defuser will report back, and you will then instruct the next step. 
+# Asks the LLM for the command in an Expert instruction that the regex could not parse
+_COMMAND_FALLBACK_PROMPT = (
+    "You relay the Expert's instruction to the bomb. "
+    "Reply with the single command it contains, as 'COMMAND: <command>' (e.g., 'COMMAND: cut wire 3')."
+)
+
+# Agent backstories. Besides the persona they hold the full protocol of every step. They are identical
+# on every call, so they form a stable prompt prefix while the task descriptions stay compact.
+DEFUSER_BACKSTORY: Final[str] = (
+    "You are a highly trained field operative. You are at the bomb site. "
+    "You DO NOT have prior knowledge of the bomb's state before each observation. "
+    "YOU MUST WAIT FOR THE RESULT OF THE TOOL CALL BEFORE PROCEEDING. "
+    "THE BOMB STATE CHANGES FROM OBSERVATION TO OBSERVATION. "
+    "You rely on your tools for observation and action, and a remote Expert for defusal knowledge. "
+    "Clarity in your descriptions (based ONLY on tool output) and precision in your actions are paramount. Failure is not an option.\n\n"
+    "EACH TASK IS A COMPACT JSON CONTRACT. ITS 'step' FIELD SELECTS THE RULES BELOW.\n"
+    "STEP 'observe': "
+    "DEFUSER, YOUR IMMEDIATE AND CRITICAL TASK IS TO ASSESS THE BOMB AND REPORT ITS STATE TO THE EXPERT. "
+    "YOU CURRENTLY HAVE NO INFORMATION ABOUT THE BOMB'S STATE. YOU MUST NOT GUESS OR RECALL ANY PREVIOUS STATE. "
+    "FOLLOW THESE STEPS IMPERATIVELY AND IN THE SPECIFIED ORDER:\n"
+    "1. READ THE RAW DATA: The 'raw_bomb_status' follows the task contract. It was JUST obtained from the server with the command 'state'. "
+    "DO NOT CALL ANY TOOL IN THIS STEP.\n"
+    "2. ANALYZE 'raw_bomb_status' FOR GAME END: Examine the provided 'raw_bomb_status'. "
+    "If, AND ONLY IF, the 'raw_bomb_status' explicitly states the bomb is 'disarmed' or 'exploded' (or similar definitive game-ending phrases like 'BOOM!'), "
+    "YOU MUST report this game over condition. Your report MUST include the FULL, UNMODIFIED 'raw_bomb_status' as evidence. "
+    "DO NOT declare game over under any other circumstances.\n"
+    "3. GENERATE DESCRIPTION FOR EXPERT (IF GAME IS ONGOING): If the 'raw_bomb_status' does NOT indicate the game is over, "
+    "YOU MUST then generate a detailed, factual description of the bomb's current appearance and components. "
+    "Focus on details that would be relevant for identifying the module and its components "
+    "based on a manual. For example, mention the number of wires and their colors, serial number, "
+    "any symbols, numbers, button labels, or the sequence of flashing lights. "
+    "Be factual and descriptive."
+    "Describe everything you see and know about the bomb -- all the details."
+    "In particular, you should describe all the numbers you can see such as stage number."
+    "Do not say anything else -- just the information in the bomb state. "
+    "This description MUST BE BASED SOLELY AND ENTIRELY ON THE 'raw_bomb_status' GIVEN IN STEP 1. "
+    "Focus on observable details critical for defusal (e.g., wire colors, numbers on wires, button labels, module types, displayed symbols or numbers, active lights). "
+    "BE PRECISE, THOROUGH, AND OBJECTIVE. DO NOT ADD ANY INTERPRETATIONS, ASSUMPTIONS, OR INFORMATION NOT DIRECTLY PRESENT IN THE 'raw_bomb_status'."
+    "YOU SHOULD ALSO DESCRIBE ALL THE PROVIDED COMMANDS."
+)
 
+# Rules for the Simon Says module, whose manual is easy to misread
+SIMON_RUBRIC: Final[str] = """
                 **SPECIAL INSTRUCTIONS -- APPLY THESE *ONLY IF* THE MANUAL EXCERPT IS FOR THE 'SIMON SAYS' MODULE:**
                 The Simon Says module requires careful interpretation of the manual.
 
@@ -196,38 +160,360 @@ async def create_bomb_defusal_crew(server_url: str, gemini_api_key: str) -> Dict
                 5  .  **Serial Number Vowel Check (Simon Says Specific):** The manual section for Simon Says will have different sub-tables based on whether the bomb's serial number contains a vowel. Use the Vowel definition from "GENERAL INSTRUCTIONS".
     """
 
-        ),
+EXPERT_BACKSTORY: Final[str] = (
+    "You are a master of explosive ordnance disposal (EOD) procedures, possessing "
+    "encyclopedic knowledge of various bomb mechanisms via manuals. "
+    "You operate remotely, relying solely on the Defuser's reports. "
+    "Your analytical skills and ability to provide precise guidance are critical "
+    "to saving the day.\n\n"
+    "EACH TASK IS A COMPACT JSON CONTRACT. ITS 'step' FIELD SELECTS THE RULES BELOW.\n"
+    "STEP 'instruct': "
+    "EXPERT, THE DEFUSER HAS PROVIDED AN UPDATE WHICH IS SUPPOSEDLY BASED ON A FRESH OBSERVATION. YOUR TASK IS TO PROVIDE A SINGLE, ACTIONABLE INSTRUCTION. EXECUTE THESE STEPS:\n"
+    "1. SCRUTINIZE the Defuser's report. If the report indicates the game is over (disarmed/exploded), YOU MUST simply acknowledge this fact. NO FURTHER ACTION IS NEEDED.\n"
+    "2. IF THE GAME IS ONGOING: The manual for the current module follows the task contract as 'manual_text'. Use the Defuser's LATEST provided description as the SOLE basis for your query to the manual. DO NOT rely on any previous information.\n"
+    "FIRST USE THE MANUAL AND THEN REASON ABOUT YOUR OUTPUT"
+    "3. BASED ON THE MANUAL AND THE DEFUSER'S LATEST DESCRIPTION, YOU MUST FORMULATE EXACTLY ONE, CLEAR, UNAMBIGUOUS, AND ACTIONABLE INSTRUCTION for the Defuser. "
+    "This instruction MUST be a command the Defuser can directly execute with their tool (e.g., 'cut wire 3', 'press red'). "
+    "DO NOT provide explanations, dialogues, or multiple options. ONE. SINGLE. COMMAND."
+    "YOUR COMMAND MUST BE ONE OF THE COMMAND PROVIDED BY THE DEFUSER."
 
-        agent=expert_agent,
-        context=[task_observe_and_describe],
-        expected_output=(
-            "A single, precise, directly executable command for the Defuser, OR a simple game over acknowledgement."
+    """
+                **Reasoning:**  Reason about your action.
+                **Single Action:** Provide only one action. The Defuser will report back, and you will then instruct the next step.
+    """
+    + SIMON_RUBRIC
+)
+
+# System prompt of a fused round: a single LLM call reads the raw bomb state and the manual
+# and answers with the Defuser command
+FUSED_SYSTEM_PROMPT: Final[str] = (
+    "You are both the Defuser at the bomb site and the EOD Expert holding the bomb defusal manual. "
+    "You receive the '### Manual' for the current module and the '### Observation': the bomb state exactly as reported by the server.\n"
+    "1. Read the manual and the bomb state. Use ONLY this information, never a previous state.\n"
+    "2. Reason briefly about the single next action.\n"
+    "3. On the LAST line, write exactly one of the available commands as 'COMMAND: <command>' "
+    "(e.g., 'COMMAND: cut wire 3', 'COMMAND: press red').\n"
+    + SIMON_RUBRIC
+)
+
+# Task contracts, passed to the tasks as compact JSON
+DEFUSER_OBSERVE = {"step": "observe", "input": "raw_bomb_status",
+                   "return": "game over report with raw_bomb_status OR factual description of raw_bomb_status"}
+EXPERT_INSTRUCT = {"step": "instruct", "input": ["latest Defuser description", "manual_text"],
+                   "return": "ONE command OR game over acknowledgement"}
+
+
+def _contract(step: Dict[str, Any]) -> str:
+    """
+    Serializes a task contract without any whitespace.
+    """
+    return json.dumps(step, separators=(",", ":"))
+
+
+# Task descriptions, built once at import. {raw_bomb_status} and {manual_text} are filled in by each kickoff.
+OBSERVE_DESCRIPTION: Final[str] = _contract(DEFUSER_OBSERVE) + "\nraw_bomb_status:\n{raw_bomb_status}"
+INSTRUCT_DESCRIPTION: Final[str] = _contract(EXPERT_INSTRUCT) + "\nmanual_text:\n{manual_text}"
+
+
+class GameOverAwareTask(Task):
+    """
+    A Task that skips its agent (LLM call and tool calls) once the game is over.
+    If the context received from the previous tasks reports a finished game,
+    the context is propagated verbatim as the task output.
+    """
+
+    def _execute_core(self, agent, context: Optional[str], tools) -> TaskOutput:
+        if context and GAME_OVER_RE.search(context):
+            return self._direct_output(agent, context)
+        return super()._execute_core(agent, context, tools)
+
+    def _direct_output(self, agent, raw: str) -> TaskOutput:
+        """
+        Records `raw` as the output of this task without running the agent.
+        """
+        agent = agent or self.agent
+        self.output = TaskOutput(
+            name=self.name,
+            description=self.description,
+            expected_output=self.expected_output,
+            raw=raw,
+            agent=agent.role if agent else "",
+        )
+        return self.output
+
+
+def _estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of the text (about 4 characters per token) without calling the API.
+    """
+    return len(text) // 4 + 1
+
+
+def _format_turn(turn: Tuple[str, Optional[str], str, str]) -> str:
+    """
+    Renders a (observation, module, command, result) turn as a single line.
+    """
+    _, module, command, result = turn
+    result_lines = result.strip().splitlines()
+    return f"[{module or 'unknown module'}] {command} -> {result_lines[0] if result_lines else ''}"
+
+
+class TurnHistory:
+    """
+    A bounded memory of the fused rounds of one game: the last `window` turns verbatim plus a
+    one-line LLM summary of the older ones, refreshed every `summary_every` turns.
+    The prompt therefore stays the same size however long the game runs.
+    """
+
+    def __init__(self, llm: LLM, window: int = 2, summary_every: int = 5):
+        self.llm = llm
+        self.summary_every = summary_every
+        self.recent_turns: Deque[Tuple[str, Optional[str], str, str]] = deque(maxlen=window)
+        self.summary = ""
+        self._unsummarized: List[Tuple[str, Optional[str], str, str]] = []
+        self._turn_count = 0
+
+    async def add(self, observation: str, module: Optional[str], command: str, result: str) -> None:
+        """
+        Records a turn, moving the oldest recent turn out of the window if it is full.
+        """
+        if len(self.recent_turns) == self.recent_turns.maxlen:
+            self._unsummarized.append(self.recent_turns[0])
+        self.recent_turns.append((observation, module, command, result))
+        self._turn_count += 1
+        if self._unsummarized and self._turn_count % self.summary_every == 0:
+            await self._refresh_summary()
+
+    async def _refresh_summary(self) -> None:
+        lines = [self.summary] if self.summary else []
+        lines += [_format_turn(turn) for turn in self._unsummarized]
+        messages = [{"role": "user", "content": (
+            "Summarize these earlier bomb defusal rounds in ONE line. "
+            "Keep the modules and the commands that were executed:\n" + "\n".join(lines)
+        )}]
+        self.summary = (await asyncio.to_thread(self.llm.call, messages)).strip()
+        self._unsummarized.clear()
+
+    def render(self, token_budget: Optional[int] = None) -> str:
+        """
+        Returns the summary of the older turns followed by the recent turns, one per line.
+        If `token_budget` is given, the oldest lines (the summary first) are left out until the rest fits.
+        """
+        lines = [f"Earlier: {self.summary}"] if self.summary else []
+        lines += [_format_turn(turn) for turn in self.recent_turns]
+        if token_budget is not None:
+            while lines and _estimate_tokens("\n".join(lines)) > token_budget:
+                lines.pop(0)
+        return "\n".join(lines)
+
+
+async def create_bomb_defusal_crew(
+        server_url: str,
+        gemini_api_key: str,
+        single_agent: bool = False,
+        temperature: float = 0.5,
+        top_p: Optional[float] = 0.8,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        shared_session: bool = True
+) -> Dict[str, Any]:
+    """
+    Creates and configures the Bomb Defusal Crew with Defuser and Expert agents.
+
+    Args:
+        server_url: The URL of the bomb defusal game server.
+        gemini_api_key: The API key for Google Gemini.
+        single_agent: If True, a single operator agent holding both tools runs the whole
+            observe -> read manual -> act loop in one task instead of the Defuser/Expert crew.
+            Play it with run_single_agent_game.
+        temperature: The sampling temperature. Use 0.0 for deterministic (cacheable) outputs.
+        top_p: The nucleus sampling parameter. Pass None to drop it (e.g. together with temperature=0.0).
+        max_tokens: The maximum number of output tokens, e.g. 256 for short single-command answers.
+        stop: The stop sequences, e.g. ROLE_STOP_SEQUENCES.
+        shared_session: If True, the Expert client uses the Defuser client's MCP session instead of
+            connecting on its own.
+
+    Returns:
+        A dictionary containing the configured "crew", "defuser_client", "expert_client", "llm",
+        "expert_llm" (which stops streaming after the answer line, for the Expert and fused rounds)
+        "command_llm" (see config.get_local_command_llm), the "tool_cache" of the tools and the
+        "single_agent" flag.
+    """
+
+    # 1. Initialize the LLM
+    stop_sequences = tuple(stop) if stop else None
+    llm = get_llm(gemini_api_key, temperature, top_p, max_tokens, stop_sequences)
+    expert_llm = get_llm(gemini_api_key, temperature, top_p, max_tokens, stop_sequences, _ANSWER_LINE_RE)
+    # Extracting a command the regex missed is plain pass-through - a local model is enough if there is one
+    command_llm = get_local_command_llm() or llm
+    print(f"Using LLM: {GEMINI_MODEL_NAME}")
+
+    # 2. Create and connect game clients for the tools
+    # If connecting one of them or building the crew fails, the exit stack cleans up the clients
+    async with AsyncExitStack() as stack:
+        defuser_game_client = await stack.enter_async_context(DefuserClient())
+        expert_game_client = await stack.enter_async_context(ExpertClient())
+
+        if shared_session:
+            print(f"Connecting DefuserClient to {server_url}...")
+            await defuser_game_client.connect_to_server(server_url)
+            # Both MCP tools are called over the Defuser's session - one handshake, one event stream
+            expert_game_client.attach(defuser_game_client)
+        else:
+            print(f"Connecting DefuserClient and ExpertClient to {server_url}...")
+            # Connected one after the other in this task: a connection can only be closed by the task
+            # that opened it, which would be a short-lived child task if the handshakes were gathered
+            await defuser_game_client.connect_to_server(server_url)
+            await expert_game_client.connect_to_server(server_url)
+        print("Game clients connected.")
+        clients_and_crew = _assemble_crew(
+            defuser_game_client, expert_game_client, llm, expert_llm, command_llm, single_agent
+        )
+        # From here on the caller is responsible for cleaning up the clients. Until then, the exit stack
+        # closes them if building the tools, agents or crew fails.
+        stack.pop_all()
+    return clients_and_crew
+
+
+def _assemble_crew(
+        defuser_game_client: DefuserClient,
+        expert_game_client: ExpertClient,
+        llm: LLM,
+        expert_llm: LLM,
+        command_llm: LLM,
+        single_agent: bool
+) -> Dict[str, Any]:
+    """
+    Builds the tools, agents, tasks and crew of create_bomb_defusal_crew around the connected game clients.
+    """
+    # 3. Instantiate tools with the connected clients
+    # The tools answer repeated 'state' queries and manual fetches from a cache dropped on every action
+    tool_cache = ToolCache()
+    defuser_action_tool = DefuserTool(defuser_game_client, response_cache=tool_cache)
+    expert_manual_tool = ExpertTool(
+        expert_game_client,
+        response_cache=tool_cache,
+        # The manuals are shared with prefetch, keyed by the module of the latest state the Defuser saw
+        manual_cache=_manual_cache,
+        module_id=lambda: _module_key(defuser_game_client.last_state or ""),
+    )
+    print("Crew tools instantiated.")
+
+    if single_agent:
+        unified_agent = Agent(
+            role="Bomb Defusal Operator",
+            goal=(
+                "Defuse the bomb by observing its state, reading the manual for the current module "
+                "and executing exactly the command the manual prescribes."
+            ),
+            backstory=(
+                "You are both the field operative at the bomb site and the EOD expert holding the manual. "
+                "You rely ONLY on your tools for the bomb state and the manual."
+            ),
+            llm=llm,
+            tools=[defuser_action_tool, expert_manual_tool],
+            max_iter=20,
+            verbose=True,
+            allow_delegation=False,
+            cache=False,
+        )
+        task_defuse = Task(
+            description=(
+                "Defuse the bomb. Use 'DefuserActionTool' with 'state', then 'ExpertManualTool', "
+                "then 'DefuserActionTool' with the single command the manual prescribes. Loop."
+            ),
+            agent=unified_agent,
+            expected_output="The final, raw server response: the bomb is either disarmed or exploded.",
+        )
+        bomb_defusal_crew = Crew(
+            agents=[unified_agent],
+            tasks=[task_defuse],
+            process=Process.sequential,
+            memory=False,
+            verbose=True
+        )
+        print("Single-agent Bomb Defusal Crew assembled.")
+
+        return {
+            "crew": bomb_defusal_crew,
+            "defuser_client": defuser_game_client,
+            "expert_client": expert_game_client,
+            "llm": llm,
+            "expert_llm": expert_llm,
+            "command_llm": command_llm,
+            "tool_cache": tool_cache,
+            "single_agent": True
+        }
+
+    # 4. Define Agents
+    defuser_agent = Agent(
+        role="Defuser",
+        goal=(
+            "Interface with a live bomb. Accurately describe its OBSERVED current state to the Expert. "
+            "The Expert's instructions are executed on the bomb as given, so your description directly "
+            "determines success or failure."
         ),
+        backstory=DEFUSER_BACKSTORY,
+        llm=llm,
+        # Commands are dispatched by execute_expert_instruction, the Defuser only observes
+        tools=[],
+        max_iter=3,
+        verbose=True,
+        allow_delegation=False,
+        # memory = False,
+        cache = False,
     )
 
-    task_defuser_act = Task(
-        # ... (task_defuser_act definition remains largely the same) ...
-        description=(
-            "DEFUSER, YOU HAVE RECEIVED AN INSTRUCTION FROM THE EXPERT. YOUR TASK IS TO EXECUTE IT OR ACKNOWLEDGE GAME OVER. FOLLOW THESE STEPS:\n"
-            "1. EXAMINE the Expert's instruction. If it is a game over acknowledgement, YOU MUST repeat that acknowledgement verbatim. NO OTHER ACTION IS REQUIRED.\n"
-            "2. IF IT IS AN ACTION COMMAND: YOU MUST execute that command using your 'DefuserActionTool' IMMEDIATELY. DO NOT DEVIATE. DO NOT INTERPRET. EXECUTE THE COMMAND AS GIVEN.\n"
-            "DO NOT SAY THAT THE GAME IS OVER IF YOU ARE NOT TOLD SO BY THE EXPERT."
-            "3. YOU MUST output the ENTIRE, UNMODIFIED, raw server response you receive after performing the action. This is CRITICAL for the next cycle."
-            "DO NOT EXECUTE MORE THAN ONE COMMAND."
+    expert_agent = Agent(
+        # ... (expert_agent definition remains the same) ...
+        role="Expert",
+        goal=(
+            "Receive and interpret bomb descriptions from the Defuser. "
+            "Utilize the bomb manual to identify the correct procedures. "
+            "Provide clear, concise, and actionable single-step instructions to the Defuser. "
+            "Ensure instructions are unambiguous and lead towards successful defusal."
         ),
+        backstory=EXPERT_BACKSTORY,
+        llm=expert_llm,
+        tools=[expert_manual_tool],
+        max_iter=3,
+        verbose=True,
+        allow_delegation=False,
+        cache = False,
+    )
+    print("Crew agents defined.")
+
+    # 5. Define Tasks
+    task_observe_and_describe = GameOverAwareTask(
+        description=OBSERVE_DESCRIPTION,
         agent=defuser_agent,
-        context=[task_expert_instruct],
         expected_output=(
-            "The complete, raw string response from the game server after executing the command, OR the verbatim game over acknowledgement from the Expert."
+            "EITHER: A highly detailed and factual description of the bomb's current state, explicitly stated as being derived *directly* from the given 'raw_bomb_status'. The description must only contain information present in the tool's output.\n"
+            "OR: A definitive game over statement (e.g., 'GAME OVER: Bomb Disarmed as per server response.' or 'GAME OVER: Bomb Exploded as per server response.') which MUST include the complete, verbatim 'raw_bomb_status' received from the server."
         ),
     )
+
+    task_expert_instruct = GameOverAwareTask(
+        # ... (task_expert_instruct definition can remain largely the same, but ensure it emphasizes using the Defuser's *latest* report)
+        description=INSTRUCT_DESCRIPTION,
+        agent=expert_agent,
+        context=[task_observe_and_describe],
+        expected_output=(
+            "A single, precise, directly executable command for the Defuser, OR a simple game over acknowledgement."
+        ),
+    )
+
     print("Crew tasks defined.")
 
     # 6. Assemble the Crew
     bomb_defusal_crew = Crew(
         agents=[defuser_agent, expert_agent],
-        tasks=[task_observe_and_describe, task_expert_instruct, task_defuser_act],
+        tasks=[task_observe_and_describe, task_expert_instruct],
+        # Sequential by necessity: the server only exposes the current module (there are no independent
+        # modules to solve concurrently) and the Expert needs the Defuser's description
         process=Process.sequential,
+        # Every kickoff gets the fresh state and manual as inputs - no context accumulates across rounds
+        memory=False,
         verbose=True
     )
     print("Bomb Defusal Crew assembled.")
@@ -235,34 +521,431 @@ async def create_bomb_defusal_crew(server_url: str, gemini_api_key: str) -> Dict
     return {
         "crew": bomb_defusal_crew,
         "defuser_client": defuser_game_client,
-        "expert_client": expert_game_client
+        "expert_client": expert_game_client,
+        "llm": llm,
+        "expert_llm": expert_llm,
+        "command_llm": command_llm,
+        "tool_cache": tool_cache,
+        "single_agent": False
     }
 
+def _module_key(raw_bomb_status: str) -> Optional[str]:
+    """
+    Identifies the type of the current module from the raw bomb state.
+
+    Returns:
+        "wires", "button", "simon" or "memory", or None if the state shows no known module.
+    """
+    match = _MODULE_RE.search(raw_bomb_status)
+    return match.lastgroup if match else None
+
+
+def _command_cache_key(raw_bomb_status: str) -> Optional[str]:
+    """
+    Returns the command cache key of the bomb state: its module type and its whitespace- and
+    case-normalized text, or None if the module is not deterministic.
+    """
+    module = _module_key(raw_bomb_status)
+    if module not in _DETERMINISTIC_MODULES:
+        return None
+    return f"{module}|{' '.join(raw_bomb_status.lower().split())}"
+
+
+def _get_command_cache() -> Dict[str, str]:
+    """
+    Returns the command cache, loading the persisted commands on first use.
+    """
+    global _command_cache
+    if _command_cache is None:
+        _command_cache = {}
+        path = os.getenv("COMMAND_CACHE_PATH")
+        if path:
+            with shelve.open(path) as db:
+                _command_cache.update(db)
+    return _command_cache
+
+
+def cached_command(raw_bomb_status: str) -> Optional[str]:
+    """
+    Returns the command that moved the game forward from this exact bomb state before, if any.
+    """
+    key = _command_cache_key(raw_bomb_status)
+    return _get_command_cache().get(key) if key else None
+
+
+def _remember_command(raw_bomb_status: str, command: str) -> None:
+    """
+    Stores a command that moved the game forward from the bomb state (deterministic modules only).
+    """
+    key = _command_cache_key(raw_bomb_status)
+    cache = _get_command_cache()
+    if key is None or cache.get(key) == command:
+        return
+    cache[key] = command
+    path = os.getenv("COMMAND_CACHE_PATH")
+    if path:
+        with shelve.open(path) as db:
+            db[key] = command
+
+
+async def _run_command(defuser_client: DefuserClient, raw_bomb_status: Optional[str], command: str) -> str:
+    """
+    Sends the command to the bomb. If it moved the game forward, it is cached for the state it was given in.
+    """
+    print(f"Executing command: {command}")
+    result = await defuser_client.run(command)
+    if raw_bomb_status and _ADVANCED_RE.search(result):
+        _remember_command(raw_bomb_status, command)
+    return result
+
+
+async def prefetch(defuser_client: DefuserClient, expert_client: ExpertClient) -> Dict[str, str]:
+    """
+    Fetches the bomb state and the manual of the current module.
+    Manuals only depend on the module type, so each one is fetched once per process and then
+    served from _manual_cache; most rounds therefore need a single round trip.
+
+    Returns:
+        The kickoff inputs "raw_bomb_status" and "manual_text" expected by the crew tasks.
+    """
+    raw_bomb_status = await defuser_client.run("state")
+    if GAME_OVER_RE.search(raw_bomb_status):
+        # The server answers a manual request with the same game over message
+        return {"raw_bomb_status": raw_bomb_status, "manual_text": raw_bomb_status}
+
+    key = _module_key(raw_bomb_status)
+    manual_text = _manual_cache.get(key) if key else None
+    if manual_text is None:
+        manual_text = await expert_client.run()
+        if key:
+            _manual_cache[key] = manual_text
+    return {"raw_bomb_status": raw_bomb_status, "manual_text": manual_text}
+
+
+def _extract_command(answer: str) -> Optional[str]:
+    """
+    Extracts the Defuser command from an LLM answer, preferring its last 'COMMAND:' line.
+
+    Returns:
+        The lowercase command, or None if the answer does not name exactly one command.
+    """
+    command_lines = _COMMAND_LINE_RE.findall(answer)
+    candidates = _VERB_RE.findall(command_lines[-1] if command_lines else answer)
+    commands = {command.lower() for command in candidates}
+    return commands.pop() if len(commands) == 1 else None
+
+
+def _turn_message(inputs: Dict[str, str], history: str = "") -> Dict[str, str]:
+    """
+    Builds the user message of one round. The constant system prompt stays first and untouched;
+    only this message changes per round. The manual, which is the same for every round of a module,
+    comes before the history and the observation so that consecutive prompts share the longest possible prefix.
+    """
+    content = f"### Manual\n{inputs['manual_text']}\n"
+    if history:
+        content += f"### Previous rounds\n{history}\n"
+    content += f"### Observation\n{inputs['raw_bomb_status']}"
+    return {"role": "user", "content": content}
+
+
+class RoundResult(BaseModel):
+    """
+    The outcome of one round: the status of the game after it and the text it produced
+    (usually the server response). str() of a RoundResult is that text.
+    "timeout" means the crew missed its deadline and the round did not act on the bomb; the game goes on.
+    """
+    status: Literal["disarmed", "exploded", "continue", "timeout"]
+    detail: str
+
+    def __str__(self) -> str:
+        return self.detail
+
+
+def _round_result(defuser_client: DefuserClient, detail: str) -> RoundResult:
+    """
+    Builds the RoundResult of a round, taking the status from what the Defuser client saw of the server.
+    """
+    return RoundResult(status=defuser_client.last_status or "continue", detail=detail)
+
+
+async def run_fused_round(
+        defuser_client: DefuserClient,
+        expert_client: ExpertClient,
+        llm: LLM,
+        history: Optional["TurnHistory"] = None
+) -> "RoundResult":
+    """
+    Plays one round with a single LLM call instead of the crew tasks:
+    the state and the manual are prefetched, the LLM turns them into one command,
+    and the command is sent to the server directly. A state solved before is answered
+    from the command cache without calling the LLM.
+
+    Args:
+        defuser_client: The connected Defuser game client.
+        expert_client: The connected Expert game client.
+        llm: The LLM, e.g. the "llm" returned by create_bomb_defusal_crew.
+        history: The memory of the previous rounds of this game. It is included in the prompt
+            and the round is added to it.
+
+    Returns:
+        The RoundResult, detailing the server response to the command,
+        or the raw bomb state if the game is already over.
+    """
+    inputs = await prefetch(defuser_client, expert_client)
+    if GAME_OVER_RE.search(inputs["raw_bomb_status"]):
+        return _round_result(defuser_client, inputs["raw_bomb_status"])
+
+    command = cached_command(inputs["raw_bomb_status"])
+    if command is None:
+        # The history gets whatever the system prompt, the manual and the observation leave of the budget
+        history_budget = PROMPT_TOKEN_BUDGET - _estimate_tokens(FUSED_SYSTEM_PROMPT) - _estimate_tokens(
+            _turn_message(inputs)["content"]
+        )
+        messages = [
+            {"role": "system", "content": FUSED_SYSTEM_PROMPT},
+            _turn_message(inputs, history.render(max(history_budget, 0)) if history else ""),
+        ]
+        # LLM.call is blocking - keep the event loop (and the game clients) responsive meanwhile
+        answer = await asyncio.to_thread(llm.call, messages)
+        print(f"Fused round LLM answer:\n{answer}")
+
+        command = _extract_command(answer)
+        if command is None:
+            return _round_result(defuser_client, f"No command found in the LLM answer:\n{answer}")
+    result = await _run_command(defuser_client, inputs["raw_bomb_status"], command)
+    if history:
+        await history.add(inputs["raw_bomb_status"], _module_key(inputs["raw_bomb_status"]), command, result)
+    return _round_result(defuser_client, result)
+
+
+async def execute_expert_instruction(
+        defuser_client: DefuserClient,
+        llm: LLM,
+        instruction: str,
+        raw_bomb_status: Optional[str] = None
+) -> str:
+    """
+    Executes the command contained in the Expert's instruction with the Defuser client directly,
+    instead of having the Defuser agent relay it to its tool. The LLM is only asked to extract
+    the command if the instruction does not name exactly one. If `raw_bomb_status` (the state the
+    instruction was given for) is passed, a command that moves the game forward is cached for it.
+
+    Returns:
+        The server response, the instruction itself if it reports a finished game,
+        or an error message if no command could be found.
+    """
+    if GAME_OVER_RE.search(instruction):
+        return instruction
+
+    command = _extract_command(instruction)
+    if command is None:
+        messages = [
+            {"role": "system", "content": _COMMAND_FALLBACK_PROMPT},
+            {"role": "user", "content": instruction},
+        ]
+        command = _extract_command(await asyncio.to_thread(llm.call, messages))
+    if command is None:
+        return f"No command found in the Expert's instruction:\n{instruction}"
+    return await _run_command(defuser_client, raw_bomb_status, command)
+
+
+async def _kickoff_with_deadline(crew: Crew, inputs: Dict[str, Any], game_over: Optional[asyncio.Event] = None) -> Any:
+    """
+    Kicks off the crew, giving up after CREW_DEADLINE_S seconds (default 30) or as soon as `game_over`
+    (the Defuser client's) is set, whichever comes first.
+    Giving up abandons the kickoff rather than stopping it: CrewAI runs it in a worker thread, which
+    cannot be cancelled and keeps running its LLM calls. Its DefuserTool calls are refused from then on
+    (see tools.kickoff_abandoned), so it cannot act on the bomb while the next round runs.
+
+    Returns:
+        The kickoff result, KICKOFF_TIMED_OUT if the deadline was hit,
+        or KICKOFF_GAME_OVER if the game ended before the kickoff did.
+    """
+    deadline = float(os.getenv("CREW_DEADLINE_S", "30"))
+    abandoned = threading.Event()
+    # Copied into the kickoff task, and from there into the kickoff's worker thread
+    token = kickoff_abandoned.set(abandoned)
+    try:
+        kickoff = asyncio.ensure_future(crew.kickoff_async(inputs=inputs))
+    finally:
+        kickoff_abandoned.reset(token)
+    waiters = {kickoff}
+    if game_over is not None:
+        waiters.add(asyncio.ensure_future(game_over.wait()))
+    try:
+        done, _ = await asyncio.wait(waiters, timeout=deadline, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters - {kickoff}:
+            waiter.cancel()
+    if kickoff in done:
+        return kickoff.result()
+    abandoned.set()
+    # The abandoned kickoff's outcome is never used - retrieve it so that a late error is not reported as unhandled
+    kickoff.add_done_callback(lambda task: task.cancelled() or task.exception())
+    if done:
+        print("The game ended before the crew kickoff finished.")
+        return KICKOFF_GAME_OVER
+    print(f"Crew kickoff did not finish within {deadline}s.")
+    return KICKOFF_TIMED_OUT
+
+
+async def run_crew_round(clients_and_crew: Dict[str, Any], inputs: Optional[Dict[str, Any]] = None) -> "RoundResult":
+    """
+    Plays one round with the crew: prefetches the bomb state and manual, kicks the crew off
+    (within the deadline) to get the Expert's instruction, then executes the instruction
+    with execute_expert_instruction. A state solved before is answered from the command cache.
+    The single-agent crew executes its commands through its own tools, so its final answer is
+    reported as is instead of being executed again (run_single_agent_game plays a whole game with it).
+    This is the single round implementation shared by main.run_crew_defusal, kickoff_batch
+    and _test_crew_creation.
+
+    Args:
+        clients_and_crew: The dictionary returned by create_bomb_defusal_crew.
+        inputs: Extra kickoff inputs, merged over the prefetched ones.
+
+    Returns:
+        The RoundResult, detailing the server response to the executed command, the raw bomb state
+        if the game is already over, or a "timeout" RoundResult if the crew missed its deadline.
+    """
+    defuser_client = clients_and_crew["defuser_client"]
+    # Commands are sent through the client, not the tools - the tools' cached responses may be stale
+    clients_and_crew["tool_cache"].invalidate()
+    round_inputs = await prefetch(defuser_client, clients_and_crew["expert_client"])
+    round_inputs.update(inputs or {})
+    raw_bomb_status = round_inputs["raw_bomb_status"]
+    if GAME_OVER_RE.search(raw_bomb_status):
+        # Nothing left to do - don't kick off the crew at all
+        return _round_result(defuser_client, raw_bomb_status)
+    command = cached_command(raw_bomb_status)
+    if command is not None:
+        # This state was solved before - no need to ask the crew again
+        return _round_result(defuser_client, await _run_command(defuser_client, raw_bomb_status, command))
+
+    instruction = await _kickoff_with_deadline(clients_and_crew["crew"], round_inputs, defuser_client.game_over)
+    if instruction is KICKOFF_TIMED_OUT:
+        return RoundResult(status="timeout", detail=CREW_TIMEOUT_RESULT)
+    if instruction is KICKOFF_GAME_OVER:
+        return _round_result(defuser_client, CREW_GAME_OVER_RESULT)
+    if clients_and_crew["single_agent"]:
+        return _round_result(defuser_client, str(instruction))
+    result = await execute_expert_instruction(
+        defuser_client, clients_and_crew["command_llm"], str(instruction), raw_bomb_status
+    )
+    return _round_result(defuser_client, result)
+
+
+async def run_single_agent_game(clients_and_crew: Dict[str, Any], max_tool_calls: int = 150) -> "RoundResult":
+    """
+    Plays a whole game with the single-agent crew's operator (create_bomb_defusal_crew(single_agent=True)).
+    Its LLM drives the operator's tools through Gemini's automatic function calling, so there is no
+    ReAct text to parse and no per-round deadline - the game runs until the LLM gives its final answer.
+
+    Args:
+        clients_and_crew: The dictionary returned by create_bomb_defusal_crew(single_agent=True).
+        max_tool_calls: The maximum number of tool calls. Later calls are refused, telling the LLM to stop.
+
+    Returns:
+        The RoundResult of the game, detailing the LLM's final answer.
+    """
+    agent = clients_and_crew["crew"].agents[0]
+    defuser_tool, expert_tool = agent.tools
+    tool_calls = 0
+
+    def _limit_reached() -> bool:
+        nonlocal tool_calls
+        tool_calls += 1
+        return tool_calls > max_tool_calls
+
+    # Called by the SDK in the worker thread of the LLM call; the tools hand the requests over to the clients' loop
+    def bomb_command(command: str) -> str:
+        """Executes a game command on the bomb (e.g. 'state', 'cut wire 1', 'press', 'release on 3') and returns the server response."""
+        if _limit_reached():
+            return "Error: Tool call limit reached. Stop calling tools and give your final answer."
+        return defuser_tool._run(command)
+
+    def read_manual() -> str:
+        """Returns the defusal manual of the current bomb module."""
+        if _limit_reached():
+            return "Error: Tool call limit reached. Stop calling tools and give your final answer."
+        return expert_tool._run()
+
+    messages = [
+        {"role": "system", "content": f"You are the {agent.role}. {agent.backstory}\nYour goal: {agent.goal}"},
+        {"role": "user", "content": (
+            "Defuse the bomb. Call bomb_command with 'state', then read_manual, then bomb_command with the single "
+            "command the manual prescribes. Repeat until the bomb is disarmed or exploded, "
+            "then answer with the final, raw server response."
+        )},
+    ]
+    available_functions = {"bomb_command": bomb_command, "read_manual": read_manual}
+    answer = await asyncio.to_thread(agent.llm.call, messages, available_functions=available_functions)
+    return _round_result(clients_and_crew["defuser_client"], answer)
+
+
+async def kickoff_batch(
+        urls: List[str],
+        gemini_api_key: str,
+        inputs: Optional[List[Dict[str, Any]]] = None,
+        max_concurrency: int = 10,
+        max_rounds: int = 150
+) -> List[RoundResult]:
+    """
+    Plays one game per server URL concurrently with a crew each, e.g. for multi-bomb evaluations.
+    Each server holds a single bomb, so the URLs must be distinct.
+
+    Args:
+        urls: The URLs of the bomb defusal game servers, one per game.
+        gemini_api_key: The API key for Google Gemini.
+        inputs: Extra kickoff inputs, one dictionary per game (in the order of `urls`). They are added
+            to the prefetched "raw_bomb_status" and "manual_text" of every round of the game.
+        max_concurrency: The maximum number of games running at the same time.
+        max_rounds: The maximum number of rounds per game.
+
+    Returns:
+        The RoundResult of the last round of each game, in the order of `urls`.
+    """
+    if len(set(urls)) != len(urls):
+        raise ValueError("kickoff_batch needs one distinct server URL per game")
+    if inputs is not None and len(inputs) != len(urls):
+        raise ValueError("kickoff_batch needs one inputs dictionary per server URL")
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _play_one(server_url: str, crew_inputs: Optional[Dict[str, Any]]) -> RoundResult:
+        async with semaphore, AsyncExitStack() as stack:
+            clients_and_crew = await create_bomb_defusal_crew(server_url, gemini_api_key)
+            await stack.enter_async_context(clients_and_crew["defuser_client"])
+            await stack.enter_async_context(clients_and_crew["expert_client"])
+            for _ in range(max_rounds):
+                result = await run_crew_round(clients_and_crew, crew_inputs)
+                if result.status in ("disarmed", "exploded"):
+                    break
+            return result
+
+    return await asyncio.gather(*(
+        _play_one(server_url, inputs[i] if inputs else None) for i, server_url in enumerate(urls)
+    ))
+
 # Example test
 async def _test_crew_creation():
-    try:
-        with open("gemini_API_key.json", "r") as f:
-            data = json.load(f)
-            gemini_key = data.get("api_key")
-    except FileNotFoundError:
-        gemini_key = os.getenv("GEMINI_API_KEY")
+    gemini_key = get_gemini_key()
     server = "http://localhost:8080"
     if not gemini_key:
         print("GEMINI_API_KEY not set.")
         return
 
-    clients_and_crew = await create_bomb_defusal_crew(server, gemini_key)
-    crew = clients_and_crew["crew"]
-    initial_inputs = {'initial_query': "The bomb is active. Get initial state."}
-    try:
-        result = crew.kickoff(inputs=initial_inputs)
-        print(f"Kickoff result: {result}")
-    except Exception as e:
-        print(f"Error during crew kickoff: {e}")
-    finally:
-        await clients_and_crew["defuser_client"].cleanup()
-        await clients_and_crew["expert_client"].cleanup()
+    async with AsyncExitStack() as stack:
+        clients_and_crew = await create_bomb_defusal_crew(server, gemini_key)
+        await stack.enter_async_context(clients_and_crew["defuser_client"])
+        await stack.enter_async_context(clients_and_crew["expert_client"])
+        try:
+            result = await run_crew_round(clients_and_crew)
+            print(f"Kickoff result: {result}")
+        except Exception as e:
+            print(f"Error during crew kickoff: {e}")
 
 if __name__ == '__main__':
-    import asyncio
-    asyncio.run(_test_crew_creation())
+    install_event_loop_policy()
+    try:
+        asyncio.run(_test_crew_creation())
+    finally:
+        close_local_command_llm()
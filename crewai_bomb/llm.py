@@ -0,0 +1,164 @@
+# crewai_bomb/llm.py
+import functools
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import google.generativeai as genai
+from crewai import LLM
+from litellm.types.utils import Usage
+
+# Gemini accepts at most 5 stop sequences per request
+_MAX_STOP_SEQUENCES = 5
+
+
+# API key the shared Gemini client is configured with. genai.configure() drops the existing client
+# (and its gRPC channel), so it is only called again when the key changes.
+_configured_api_key: Optional[str] = None
+# Guards the global genai configuration and the model cache built on it: crews build their LLMs and
+# call them from several threads (CrewAI worker threads, kickoff_batch, run_batch)
+_genai_lock = threading.Lock()
+
+
+def _configure_genai(api_key: str) -> None:
+    """
+    Configures the process-wide Gemini client with a single long-lived gRPC channel.
+    """
+    global _configured_api_key
+    with _genai_lock:
+        if api_key != _configured_api_key:
+            genai.configure(api_key=api_key, transport="grpc")
+            _get_model.cache_clear()
+            _configured_api_key = api_key
+
+
+@functools.lru_cache(maxsize=32)
+def _get_model(model_name: str, system_instruction: Optional[str]) -> genai.GenerativeModel:
+    """
+    Returns the GenerativeModel for the model and system instruction, shared by all agents.
+    """
+    return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+
+def _to_gemini_contents(messages: List[Dict[str, str]]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """
+    Splits chat messages into Gemini's system instruction and 'user'/'model' contents.
+    """
+    system_instruction = None
+    contents = []
+    for msg in messages:
+        if msg["role"] == "system":
+            if system_instruction:  # Concatenate if multiple system prompts
+                system_instruction = f"{system_instruction}\n{msg['content']}"
+            else:
+                system_instruction = msg["content"]
+        else:
+            role = "model" if msg["role"] == "assistant" else "user"
+            contents.append({"role": role, "parts": [msg["content"]]})
+    return system_instruction, contents
+
+
+def _report_usage(callbacks: Optional[List[Any]], params: Dict[str, Any], usage_metadata: Any) -> None:
+    """
+    Forwards Gemini's token usage to the callbacks the way the litellm-based LLM does,
+    e.g. to CrewAI's TokenCalcHandler for the crew's usage metrics.
+    """
+    if not callbacks or not usage_metadata:
+        return
+    usage = Usage(
+        prompt_tokens=usage_metadata.prompt_token_count,
+        completion_tokens=usage_metadata.candidates_token_count,
+        total_tokens=usage_metadata.total_token_count,
+    )
+    for callback in callbacks:
+        if hasattr(callback, "log_success_event"):
+            callback.log_success_event(kwargs=params, response_obj={"usage": usage}, start_time=0, end_time=0)
+
+
+def _close_stream(stream: Any) -> None:
+    """
+    Ends a streamed response before its last chunk. The gRPC call is cancelled, so the server stops
+    generating and the channel is freed; if it cannot be cancelled, the rest of the stream is read.
+    """
+    cancel = getattr(getattr(stream, "_iterator", None), "cancel", None)
+    if callable(cancel):
+        cancel()
+    else:
+        stream.resolve()
+
+
+class StreamingGeminiLLM(LLM):
+    """
+    A CrewAI LLM calling Gemini through the native google-generativeai SDK instead of litellm.
+    The response is streamed; if `early_stop_pattern` is set, generation is abandoned
+    as soon as the accumulated text matches it (e.g. crew._ANSWER_LINE_RE for a complete answer line).
+    Given `available_functions`, call() uses Gemini's automatic function calling instead (see crew.run_single_agent_game).
+    """
+
+    def __init__(
+            self,
+            model: str,
+            api_key: str,
+            early_stop_pattern: Optional[re.Pattern] = None,
+            **kwargs: Any
+    ):
+        super().__init__(model=model, api_key=api_key, **kwargs)
+        _configure_genai(api_key)
+        self.early_stop_pattern = early_stop_pattern
+
+    def supports_function_calling(self) -> bool:
+        # CrewAI agents never pass their tools to call(), so they use them through its text (ReAct) format
+        return False
+
+    def supports_stop_words(self) -> bool:
+        return True
+
+    def call(
+            self,
+            messages: Union[str, List[Dict[str, str]]],
+            tools: Optional[List[dict]] = None,
+            callbacks: Optional[List[Any]] = None,
+            available_functions: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        system_instruction, contents = _to_gemini_contents(messages)
+
+        generation_config = genai.types.GenerationConfig(
+            candidate_count=1,
+            max_output_tokens=self.max_tokens,
+            temperature=self.temperature,
+            top_p=self.top_p,
+            top_k=self.additional_params.get("top_k"),
+            stop_sequences=(self.stop or [])[:_MAX_STOP_SEQUENCES] or None,
+        )
+        with _genai_lock:
+            model_instance = _get_model(self.model, system_instruction)
+        if available_functions:
+            # Gemini calls the functions itself until it has a text answer. Their declarations are built from
+            # their signatures and docstrings, so `tools` (OpenAI-style schemas) is not needed.
+            chat = model_instance.start_chat(history=contents[:-1], enable_automatic_function_calling=True)
+            response = chat.send_message(
+                contents[-1], generation_config=generation_config, tools=list(available_functions.values())
+            )
+            _report_usage(callbacks, {"model": self.model, "messages": messages}, response.usage_metadata)
+            return response.text
+        stream = model_instance.generate_content(contents, generation_config=generation_config, stream=True)
+
+        text = ""
+        # Every chunk carries the usage so far; the last one received covers the whole call
+        usage_metadata = None
+        for chunk in stream:
+            usage_metadata = chunk.usage_metadata or usage_metadata
+            if not chunk.parts:
+                continue
+            text += chunk.text
+            if self.early_stop_pattern:
+                match = self.early_stop_pattern.search(text)
+                if match:
+                    # Drop the rest of the stream - the command is already complete
+                    _close_stream(stream)
+                    text = text[:match.end()]
+                    break
+        _report_usage(callbacks, {"model": self.model, "messages": messages}, usage_metadata)
+        return text
@@ -1,94 +1,140 @@
 # crewai_bomb/main.py
 import argparse
 import asyncio
-import json
+import logging
 import os
-import nest_asyncio # For handling nested asyncio event loops
-from game_mcp import game_client
-from crewai_bomb.crew import create_bomb_defusal_crew
-
-async def run_crew_defusal(server_url: str, gemini_api_key: str):
-    # Apply nest_asyncio once at the beginning.
-    # This is crucial for allowing asyncio.run() calls from tools
-    # if the main script or CrewAI itself runs within an event loop.
-    nest_asyncio.apply()
+import sys
+import time
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List
 
+from game_mcp import game_client
+from crewai_bomb.config import close_local_command_llm, get_gemini_key, install_event_loop_policy
+from crewai_bomb.crew import TurnHistory, create_bomb_defusal_crew, run_crew_round, run_fused_round
+
+logger = logging.getLogger(__name__)
+
+# Minimum time between two logged tracebacks. Errors in between (e.g. many batched games failing
+# against a flaky server) are logged as a single line.
+_TRACEBACK_INTERVAL_S = 5.0
+_last_traceback_time = float("-inf")
+
+
+def _log_unexpected_error(error: Exception) -> None:
+    """
+    Logs an unexpected error, with its traceback at most once every _TRACEBACK_INTERVAL_S seconds.
+    """
+    global _last_traceback_time
+    now = time.monotonic()
+    if now - _last_traceback_time >= _TRACEBACK_INTERVAL_S:
+        _last_traceback_time = now
+        logger.exception("Main Error: An unexpected error occurred: %s", error)
+    else:
+        logger.error("Main Error: An unexpected error occurred: %s", error)
+
+
+async def _cleanup_clients(clients_and_crew: Dict[str, Any]) -> None:
+    """
+    Closes the Expert and Defuser connections, one after the other in the calling task: the anyio task groups
+    of a connection can only be exited by the task that opened them, so they must not be closed in child tasks.
+    The Expert goes first, as it may only be attached to the Defuser's connection.
+    """
+    for name in ("expert_client", "defuser_client"):
+        try:
+            await clients_and_crew[name].cleanup()
+        except Exception as e:
+            logger.error("Error while closing the %s: %s", name, e)
+
+
+async def run_crew_defusal(server_url: str, gemini_api_key: str, fused: bool = False) -> str:
     try:
-        # Create the Bomb Defusal Crew
-        bomb_defusal_crew_dict = await create_bomb_defusal_crew(server_url, gemini_api_key)
-        bomb_defusal_crew = bomb_defusal_crew_dict["crew"]
-
-        print("\nStarting the Bomb Defusal Crew in a loop...")
-
-        game_continues = True
-        iteration_count = 0
-        max_iterations = 150  # Safety break to prevent infinite loops
-        final_status_message = "Game ended due to maximum iterations."
-
-        while game_continues and iteration_count < max_iterations:
-            iteration_count += 1
-            print(f"\n--- Starting Crew Iteration {iteration_count} ---")
-
-            # The `inputs` for kickoff. For our current task setup in crew.py,
-            # the first task (task_observe_and_describe) always starts by fetching the current bomb state.
-            # Therefore, no specific inputs are strictly needed to carry over state between iterations here.
-            # If your tasks were designed to need explicit context from the *previous full crew run*,
-            # this is where you'd pass it, e.g., inputs={'previous_outcome': last_result}
-            # The agents have their memory and can use it to remember the previous inputs.
-            kickoff_inputs = {}
-
-            result = await bomb_defusal_crew.kickoff_async(inputs=kickoff_inputs)
-
-            print("\n----------------------------------------------------")
-            print(f"Output of Crew Iteration {iteration_count}:")
-            print(result)  # This 'result' is the output of the last task in the crew sequence
-            print("----------------------------------------------------")
-
-            # Check for game-ending conditions in the result string
-            result = str(result)
-            result_lower = result.lower()
-
-            if "bomb successfully disarmed" in result_lower or \
-                    "bomb disarmed!" in result_lower:
-                final_status_message = "BOMB SUCCESSFULLY DISARMED!"
-                print(f"Game Concluded: {final_status_message}")
-                game_continues = False
-            elif "bomb has exploded" in result_lower or \
-                    "bomb exploded!" in result_lower or \
-                    "boom!" in result_lower:  # "BOOM!" is a common server response for explosion
-                final_status_message = "BOMB EXPLODED!"
-                print(f"Game Concluded: {final_status_message}")
-                game_continues = False
-            elif "game over" in result_lower:  # Check if an agent explicitly states "game over"
-                # This could happen if task_observe_and_describe sees a pre-existing ended state
-                final_status_message = f"Game Over: {result}"
-                print(f"Game Concluded: {final_status_message}")
-                game_continues = False
-
-            if not game_continues and iteration_count == max_iterations:  # Overwrite if max_iterations hit
-                final_status_message = f"Game ended: Reached maximum iterations ({max_iterations}). Last result: {result}"
-
-        # You might want to check the game_client's last known state or parse 'result'
-        # to determine if the bomb was defused or exploded for a final status message.
-        # For example, if the last 'result' contains "BOMB SUCCESSFULLY DISARMED!" or "BOOM!".
-
-        await bomb_defusal_crew_dict["defuser_client"].cleanup()
-        await bomb_defusal_crew_dict["expert_client"].cleanup()
+        async with AsyncExitStack() as stack:
+            # Create the Bomb Defusal Crew
+            bomb_defusal_crew_dict = await create_bomb_defusal_crew(server_url, gemini_api_key)
+            # The clients are closed however the game ends, also if a round raises
+            stack.push_async_callback(_cleanup_clients, bomb_defusal_crew_dict)
+
+            print("\nStarting the Bomb Defusal Crew in a loop...")
+
+            game_continues = True
+            iteration_count = 0
+            max_iterations = 150  # Safety break to prevent infinite loops
+            final_status_message = "Game ended due to maximum iterations."
+            # Bounded memory of the previous rounds, used by the fused rounds
+            history = TurnHistory(bomb_defusal_crew_dict["llm"])
+
+            while game_continues and iteration_count < max_iterations:
+                iteration_count += 1
+                print(f"\n--- Starting Crew Iteration {iteration_count} ---")
+
+                if fused:
+                    # One LLM call per round: observe, consult the manual and act without the crew tasks.
+                    result = await run_fused_round(
+                        bomb_defusal_crew_dict["defuser_client"],
+                        bomb_defusal_crew_dict["expert_client"],
+                        bomb_defusal_crew_dict["expert_llm"],
+                        history
+                    )
+                else:
+                    # Observe, instruct and execute the Expert's command (see crew.run_crew_round)
+                    result = await run_crew_round(bomb_defusal_crew_dict)
+
+                print("\n----------------------------------------------------")
+                print(f"Output of Crew Iteration {iteration_count}:")
+                print(result)  # The server response to the Expert's command (or the game over acknowledgement)
+                print("----------------------------------------------------")
+
+                # The round reports the status of the game the Defuser client saw in the server responses
+                if result.status == "disarmed":
+                    final_status_message = "BOMB SUCCESSFULLY DISARMED!"
+                    print(f"Game Concluded: {final_status_message}")
+                    game_continues = False
+                elif result.status == "exploded":
+                    final_status_message = "BOMB EXPLODED!"
+                    print(f"Game Concluded: {final_status_message}")
+                    game_continues = False
+
+                if not game_continues and iteration_count == max_iterations:  # Overwrite if max_iterations hit
+                    final_status_message = f"Game ended: Reached maximum iterations ({max_iterations}). Last result: {result}"
+
+            return final_status_message
     except ConnectionRefusedError:
-        print(f"Main Error: Could not connect to the server at {server_url}. Ensure the server is running.")
+        logger.error("Main Error: Could not connect to the server at %s. Ensure the server is running.", server_url)
+        return f"Could not connect to {server_url}"
+    except asyncio.TimeoutError:
+        logger.error("Main Error: Timed out talking to the server at %s.", server_url)
+        return f"Timed out talking to {server_url}"
     except Exception as e:
-        print(f"Main Error: An unexpected error occurred: {e}")
-        import traceback
-        traceback.print_exc()
+        _log_unexpected_error(e)
+        return f"Error: {e}"
+
+
+async def run_batch(urls: List[str], gemini_api_key: str, concurrency: int = 8, fused: bool = False) -> List[str]:
+    """
+    Plays one game per server URL concurrently in this event loop, at most `concurrency` at a time.
+    Each server holds a single bomb, so the URLs must be distinct.
+    All games share the same LLM instance (and so the same Gemini client).
+
+    Returns:
+        The final status message of each game, in the order of `urls`.
+    """
+    if len(set(urls)) != len(urls):
+        raise ValueError("run_batch needs one distinct server URL per game")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run_one(url: str) -> str:
+        async with semaphore:
+            return await run_crew_defusal(url, gemini_api_key, fused)
+
+    results = await asyncio.gather(*(_run_one(url) for url in urls))
+    print("\n=== Batch results ===")
+    for url, status in zip(urls, results):
+        print(f"{url}: {status}")
+    return results
+
 
 def main():
     parser = argparse.ArgumentParser(description="CrewAI Bomb Defusal Client")
-    try:
-        with open("gemini_API_key.json", "r") as f:
-            data = json.load(f)
-            gemini_key = data.get("api_key")
-    except FileNotFoundError:
-        gemini_key = os.getenv("GEMINI_API_KEY")
     parser.add_argument(
         "--url",
         default=os.getenv("MCP_SERVER_URL", "http://localhost:8080"),
@@ -96,27 +142,66 @@ def main():
     )
     parser.add_argument(
         "--gemini_api_key",
-        default=gemini_key,
         help="Gemini API Key (can also be set via GEMINI_API_KEY env var or in a json file)"
     )
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="Play each round with a single LLM call instead of the crew tasks"
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=0,
+        help="Play N games concurrently, one per server URL from --urls-file"
+    )
+    parser.add_argument(
+        "--urls-file",
+        help="File with one MCP Game Server URL per line, required with --batch. Each server holds a "
+             "single bomb, so it needs at least N distinct URLs."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Maximum number of games played at the same time with --batch (default: 8)"
+    )
     args = parser.parse_args()
+    urls: List[str] = []
+    if args.batch:
+        # The server has one global bomb - two games against the same server would act on the same bomb
+        if not args.urls_file:
+            parser.error("--batch requires --urls-file")
+        with open(args.urls_file, "r") as f:
+            urls = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+        if len(urls) < args.batch:
+            parser.error(f"--batch {args.batch} needs {args.batch} distinct URLs, {args.urls_file} has {len(urls)}")
+        urls = urls[:args.batch]
+    # The tools log each call at DEBUG level - set BOMB_LOG_LEVEL=DEBUG to see them
+    logging.basicConfig(level=os.getenv("BOMB_LOG_LEVEL", "WARNING").upper())
+    # The key file is only read if no key was given on the command line
+    args.gemini_api_key = args.gemini_api_key or get_gemini_key()
 
     if not args.gemini_api_key:
         print("Error: Gemini API Key is required. "
               "Set --gemini_api_key argument or GEMINI_API_KEY environment variable.")
         return
 
+    install_event_loop_policy()
+
     # Python's asyncio.run is a good way to run the top-level async function
     try:
-        asyncio.run(run_crew_defusal(args.url, args.gemini_api_key))
+        if args.batch:
+            asyncio.run(run_batch(urls, args.gemini_api_key, args.concurrency, args.fused))
+        else:
+            asyncio.run(run_crew_defusal(args.url, args.gemini_api_key, args.fused))
     except KeyboardInterrupt:
         print("\nUser interrupted. Exiting...")
-        import sys
         sys.exit(0)
     except Exception as e:
-        print(f"Main Error: An unexpected error occurred: {e}")
-        import traceback
-        traceback.print_exc()
+        _log_unexpected_error(e)
+    finally:
+        close_local_command_llm()
 
 
 
@@ -1,17 +1,120 @@
 # crewai_bomb/tools.py
 import asyncio
-import time
-import traceback # Optional: for more detailed error logging during development
-from concurrent.futures import ThreadPoolExecutor
-from typing import Type
+import logging
+import os
+import threading
+import weakref
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Type
 
-from click import command
 from crewai.tools import BaseTool
+from pydantic import BaseModel, ConfigDict, Field
 
 
 from game_mcp.game_client import Defuser as DefuserClient, Expert as ExpertClient
 
 
+logger = logging.getLogger(__name__)
+
+# Maximum number of tool calls in flight at once, across all tools (and crews) of an event loop
+_TOOL_CONCURRENCY = int(os.getenv("BOMB_TOOL_CONCURRENCY", "4"))
+# One semaphore per event loop: a semaphore binds to the first loop that waits on it, and a process
+# may run several loops one after the other (e.g. separate asyncio.run() calls)
+_tool_sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+async def _limited(coro):
+    """
+    Awaits the tool call's coroutine once fewer than BOMB_TOOL_CONCURRENCY calls are in flight on its loop.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _tool_sems.get(loop)
+    if semaphore is None:
+        semaphore = _tool_sems[loop] = asyncio.Semaphore(_TOOL_CONCURRENCY)
+    async with semaphore:
+        return await coro
+
+
+def _run_on_loop(loop: asyncio.AbstractEventLoop, coro):
+    """
+    Runs the coroutine on `loop` - the loop the game client was connected on - and returns its result.
+    CrewAI runs tools from a worker thread during kickoff_async, so the coroutine is handed over
+    to the client's loop in that case instead of being run on a loop of its own.
+    Code running on `loop` itself must await the tool's _arun() instead.
+    """
+    if loop.is_running():
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            coro.close()
+            raise RuntimeError("Tool called synchronously from its own event loop - await its _arun() instead.")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+    return loop.run_until_complete(coro)
+
+
+# Set by crew._kickoff_with_deadline() for the kickoff it runs; the kickoff (and its worker thread) inherits it.
+# A kickoff that missed its deadline keeps running, so the event is set to stop its tools from acting on the bomb.
+kickoff_abandoned: ContextVar[Optional[threading.Event]] = ContextVar("kickoff_abandoned", default=None)
+
+# Returned instead of executing a command for an abandoned kickoff
+_ABANDONED_RESULT = "Error: This round was abandoned after its deadline. The command was not executed."
+
+
+def _abandoned() -> bool:
+    abandoned = kickoff_abandoned.get()
+    return abandoned is not None and abandoned.is_set()
+
+
+# Defuser commands that only read the bomb. Their responses stay valid until the next action.
+_READ_ONLY_COMMANDS = frozenset({"state", "help"})
+
+
+class ToolCache:
+    """
+    Responses of the read-only tool calls ('state', 'help' and the manual), shared by the tools of one crew.
+    The manual only depends on the current module, so every entry stays valid until the next bomb action.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, key: str, result: str) -> None:
+        self.entries[key] = result
+
+    def invalidate(self) -> None:
+        """
+        Drops every entry - to be called before an action that may change the bomb.
+        """
+        self.entries.clear()
+
+
+class DefuserToolInput(BaseModel):
+    """
+    Arguments of DefuserTool. Extra arguments invented by the LLM are dropped instead of failing validation.
+    """
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    command: str = Field(..., description="The game command, e.g. 'state' or 'cut wire 1'.")
+
+
+class ExpertToolInput(BaseModel):
+    """
+    ExpertTool takes no arguments. Any argument the LLM passes (e.g. a module query) is dropped.
+    """
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+
 class DefuserTool(BaseTool):
     name: str = "DefuserActionTool"
     description: str = (
@@ -20,45 +123,90 @@ class DefuserTool(BaseTool):
         "e.g., 'state', 'cut wire 1', 'press button', 'release on 3'. "
         "The tool executes the command and returns the bomb's response."
     )
-    # This client is an instance of the DefuserClient class from game_mcp.game_client.py
-    defuser_game_client: Type[DefuserClient] = None
-    loop: asyncio.AbstractEventLoop = None
+    args_schema: Type[BaseModel] = DefuserToolInput
+    # Fields are set once by the constructor; assignments are not re-validated
+    model_config = ConfigDict(arbitrary_types_allowed=True, validate_assignment=False)
+    # The connected DefuserClient (game_mcp.game_client.py) shared with the crew, which owns its cleanup
+    defuser_game_client: Optional[DefuserClient] = None
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    response_cache: Optional[ToolCache] = None
 
 
-    def __init__(self, server_url: str, **kwargs):
-        super().__init__(**kwargs)
-        # Ensure class-defined name and description are used if not overridden by kwargs to super()
-        # self.name = DefuserTool.name?
-        # self.description = DefuserTool.description
-        self.defuser_game_client = DefuserClient()
-        self.loop = asyncio.new_event_loop()
-        self.loop.run_until_complete(self.defuser_game_client.connect_to_server(server_url))
+    def __init__(self, defuser_game_client: DefuserClient, **kwargs):
+        """
+        Uses the already connected `defuser_game_client` for every call instead of opening a connection of its own.
+        Must be created on the event loop the client was connected on. If a `response_cache` is given,
+        read-only commands are answered from it and any other command invalidates it.
+        """
+        # Checked once here rather than on every call
+        if not callable(getattr(defuser_game_client, "run", None)):
+            raise TypeError(f"{type(defuser_game_client).__name__} has no run() method to call the game server with.")
+        super().__init__(defuser_game_client=defuser_game_client, loop=asyncio.get_running_loop(), **kwargs)
+
+    @classmethod
+    async def from_server_url(cls, server_url: str, **kwargs) -> "DefuserTool":
+        """
+        Creates the tool with a DefuserClient of its own, connected to `server_url`.
+        The caller owns the client (tool.defuser_game_client) and its cleanup.
+        """
+        client = DefuserClient()
+        await client.connect_to_server(server_url)
+        return cls(client, **kwargs)
 
     def _run(self, command: str) -> str:
         """
         Executes a command using the DefuserClient and returns the result.
         The 'command' is the string input from the Defuser LLM agent.
         """
-        print(f"[{self.name}] Received command: {command}.")
+        logger.debug("[%s] Received command: %s.", self.name, command)
+        if _abandoned():
+            return _ABANDONED_RESULT
+        cached = self._cached_response(command)
+        if cached is not None:
+            return cached
         try:
 
-            result = self.loop.run_until_complete(self.defuser_game_client.run(command))
-            print(f"[{self.name}] Command executed. Result: {result}")
+            result = _run_on_loop(self.loop, _limited(self.defuser_game_client.run(command)))
+            logger.debug("[%s] Command executed. Result: %s", self.name, result)
+            self._cache_response(command, result)
             return result
         except Exception as e:
-            print(f"[{self.name}] Error retrieving executing command: {e}")
-            # traceback.print_exc() # Uncomment for detailed stack trace
+            logger.error("[%s] Error retrieving executing command: %s", self.name, e)
             return f"Error: Could not execute command'. Detail: {str(e)}"
 
+    async def _arun(self, command: str) -> str:
+        """
+        Executes a command on the event loop it is awaited on (the one the DefuserClient was connected on).
+        """
+        if _abandoned():
+            return _ABANDONED_RESULT
+        cached = self._cached_response(command)
+        if cached is not None:
+            return cached
+        try:
+            result = await _limited(self.defuser_game_client.run(command))
+            self._cache_response(command, result)
+            return result
+        except Exception as e:
+            logger.error("[%s] Error retrieving executing command: %s", self.name, e)
+            return f"Error: Could not execute command'. Detail: {str(e)}"
 
+    def _cached_response(self, command: str) -> Optional[str]:
+        """
+        Returns the cached response of a read-only command. Any other command invalidates the cache.
+        """
+        if self.response_cache is None:
+            return None
+        key = command.strip().lower()
+        if key in _READ_ONLY_COMMANDS:
+            return self.response_cache.get(key)
+        self.response_cache.invalidate()
+        return None
 
-    def clean_up(self):
-        self.defuser_game_client.cleanup()
-
-    # def __del__(self):
-    #     self.defuser_game_client.cleanup()
-
-
+    def _cache_response(self, command: str, result: str) -> None:
+        key = command.strip().lower()
+        if self.response_cache is not None and key in _READ_ONLY_COMMANDS:
+            self.response_cache.put(key, result)
 
 
 class ExpertTool(BaseTool):
@@ -67,40 +215,88 @@ class ExpertTool(BaseTool):
         "Use this tool to retrieve the bomb defusal manual for the current bomb module. "
         "The tool returns the relevant manual content as a string."
     )
-    # This client is an instance of the ExpertClient class from game_mcp.game_client.py
-    expert_game_client: Type[ExpertClient] = None
-    loop: asyncio.AbstractEventLoop = None
+    args_schema: Type[BaseModel] = ExpertToolInput
+    # Fields are set once by the constructor; assignments are not re-validated
+    model_config = ConfigDict(arbitrary_types_allowed=True, validate_assignment=False)
+    # The connected ExpertClient (game_mcp.game_client.py) shared with the crew, which owns its cleanup
+    expert_game_client: Optional[ExpertClient] = None
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    response_cache: Optional[ToolCache] = None
+    # Manuals by module id, and the function telling the id of the current module (None if unknown)
+    manual_cache: Optional[Dict[str, str]] = None
+    module_id: Optional[Callable[[], Optional[str]]] = None
 
 
-    def __init__(self, server_url: str, **kwargs):
-        super().__init__(**kwargs)
-        # Ensure class-defined name and description are used if not overridden by kwargs to super()
-        # self.name = DefuserTool.name?
-        # self.description = DefuserTool.description
-        self.expert_game_client = ExpertClient()
-        self.loop = asyncio.new_event_loop()
-        self.loop.run_until_complete(self.expert_game_client.connect_to_server(server_url))
+    def __init__(self, expert_game_client: ExpertClient, **kwargs):
+        """
+        Uses the already connected `expert_game_client` for every call instead of opening a connection of its own.
+        Must be created on the event loop the client was connected on. If a `response_cache` (the one of the
+        DefuserTool, which invalidates it on every action) is given, the manual is only fetched once per module.
+        With a `manual_cache` and a `module_id` function, manuals are also kept across actions, per module id.
+        """
+        # Checked once here rather than on every call
+        if not callable(getattr(expert_game_client, "run", None)):
+            raise TypeError(f"{type(expert_game_client).__name__} has no run() method to call the game server with.")
+        super().__init__(expert_game_client=expert_game_client, loop=asyncio.get_running_loop(), **kwargs)
+
+    @classmethod
+    async def from_server_url(cls, server_url: str, **kwargs) -> "ExpertTool":
+        """
+        Creates the tool with an ExpertClient of its own, connected to `server_url`.
+        The caller owns the client (tool.expert_game_client) and its cleanup.
+        """
+        client = ExpertClient()
+        await client.connect_to_server(server_url)
+        return cls(client, **kwargs)
 
     def _run(self) -> str:
         """
         Retrieves manual information using the ExpertClient based on the module query.
         The 'module_query' is the string input from the Expert LLM agent.
         """
-        print(f"[{self.name}] Received manual query from agent.")
+        logger.debug("[%s] Received manual query from agent.", self.name)
+        module = self.module_id() if self.module_id else None
+        cached = self._cached_manual(module)
+        if cached is not None:
+            return cached
         try:
 
-            manual_content = self.loop.run_until_complete(self.expert_game_client.run())
-            print(f"[{self.name}] Manual content retrieved.")
+            manual_content = _run_on_loop(self.loop, _limited(self.expert_game_client.run()))
+            logger.debug("[%s] Manual content retrieved.", self.name)
+            self._cache_manual(module, manual_content)
             # To avoid overwhelming the LLM, you might want to summarize or indicate if content is too long.
             # For now, returning the full content.
             return manual_content
         except Exception as e:
-            print(f"[{self.name}] Error retrieving manual: {e}")
-            # traceback.print_exc() # Uncomment for detailed stack trace
+            logger.error("[%s] Error retrieving manual: %s", self.name, e)
+            return f"Error: Could not retrieve manual content'. Detail: {str(e)}"
+
+    async def _arun(self) -> str:
+        """
+        Retrieves the manual on the event loop it is awaited on (the one the ExpertClient was connected on).
+        """
+        module = self.module_id() if self.module_id else None
+        cached = self._cached_manual(module)
+        if cached is not None:
+            return cached
+        try:
+            manual_content = await _limited(self.expert_game_client.run())
+            self._cache_manual(module, manual_content)
+            return manual_content
+        except Exception as e:
+            logger.error("[%s] Error retrieving manual: %s", self.name, e)
             return f"Error: Could not retrieve manual content'. Detail: {str(e)}"
 
-    def clean_up(self):
-        self.expert_game_client.cleanup()
+    def _cached_manual(self, module: Optional[str]) -> Optional[str]:
+        """
+        Returns the cached manual of the module, or the one fetched since the last action.
+        """
+        if module and self.manual_cache is not None and module in self.manual_cache:
+            return self.manual_cache[module]
+        return self.response_cache.get("manual") if self.response_cache else None
 
-    # def __del__(self):
-    #     self.expert_game_client.cleanup()
\ No newline at end of file
+    def _cache_manual(self, module: Optional[str], manual_content: str) -> None:
+        if module and self.manual_cache is not None:
+            self.manual_cache[module] = manual_content
+        if self.response_cache:
+            self.response_cache.put("manual", manual_content)
@@ -1,4 +1,5 @@
 import argparse
+import json
 
 import uvicorn
 from mcp.server.fastmcp import FastMCP
@@ -18,6 +19,7 @@ bomb = Bomb()
 BOMB_EXPLODED = f"=== BOOM! THE BOMB HAS EXPLODED. GAME OVER. === \n\n'"
 BOMB_DISARMED = f"=== BOMB SUCCESSFULLY DISARMED! CONGRATULATIONS! ===\n\n"
 UNKNOWN_COMMAND = "Unknown command. Type 'help' for available commands.\n\n"
+INVALID_BATCH = "Invalid batch. Expected a JSON list of command strings, e.g. [\"state\", \"cut wire 1\"].\n\n"
 HELP_TEXT = """Keep Talking and Nobody Explodes
 
 Game Description:
@@ -81,6 +83,29 @@ async def game_interaction(command: str) -> str:
     return UNKNOWN_COMMAND
 
 
+@mcp.tool()
+async def game_interaction_batch(commands: str) -> str:
+    """Execute several commands in one call, stopping early if the game ends.
+
+    Args:
+        commands: str: JSON list of the commands to execute, in order.
+    """
+    try:
+        command_list = json.loads(commands)
+    except json.JSONDecodeError:
+        return INVALID_BATCH
+    if not isinstance(command_list, list) or not all(isinstance(command, str) for command in command_list):
+        return INVALID_BATCH
+
+    responses = []
+    for command in command_list:
+        responses.append(await game_interaction(command))
+        if bomb.exploded or bomb.disarmed:
+            break
+
+    return json.dumps(responses)
+
+
 @mcp.tool()
 async def get_manual() -> str:
     """Get the manual for the game."""
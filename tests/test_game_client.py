@@ -0,0 +1,74 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import anyio
+
+from game_mcp.game_client import BombClient, Defuser, Expert
+
+
+class FakeSession:
+    """A ClientSession answering every call with `text`, whose first `failures` calls lose the connection."""
+
+    def __init__(self, text: str, failures: int = 0):
+        self.text = text
+        self.failures = failures
+        self.calls = []
+
+    async def call_tool(self, tool_name, tool_args):
+        self.calls.append((tool_name, tool_args))
+        if self.failures:
+            self.failures -= 1
+            raise anyio.ClosedResourceError()
+        return SimpleNamespace(content=[SimpleNamespace(text=self.text)])
+
+
+class ReconnectTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # Each connection attempt hands out the next session instead of connecting to a server
+        self.sessions = []
+
+        async def fake_open(client, server_url, sse_read_timeout, timeout):
+            client.session = self.sessions.pop(0)
+
+        patcher = mock.patch.object(BombClient, "_open", fake_open)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_read_only_call_is_sent_again_after_reconnect(self):
+        lost, new = FakeSession("lost", failures=1), FakeSession("=== BOMB STATE ===")
+        self.sessions = [lost, new]
+        defuser = Defuser()
+        await defuser.connect_to_server("http://test")
+
+        self.assertEqual(await defuser.run("state"), "=== BOMB STATE ===")
+        self.assertIs(defuser.session, new)
+        self.assertEqual(new.calls, [("game_interaction", {"command": "state"})])
+
+    async def test_action_is_not_sent_again_after_reconnect(self):
+        lost, new = FakeSession("lost", failures=1), FakeSession("unused")
+        self.sessions = [lost, new]
+        defuser = Defuser()
+        await defuser.connect_to_server("http://test")
+
+        with self.assertRaises(anyio.ClosedResourceError):
+            await defuser.run("cut wire 1")
+        # Reconnected, but the action is left to the caller as the server may have executed it
+        self.assertIs(defuser.session, new)
+        self.assertEqual(new.calls, [])
+
+    async def test_attached_client_reconnects_the_shared_connection(self):
+        lost, new = FakeSession("lost", failures=1), FakeSession("Regular Wires Module")
+        self.sessions = [lost, new]
+        defuser = Defuser()
+        await defuser.connect_to_server("http://test")
+        expert = Expert()
+        expert.attach(defuser)
+
+        self.assertEqual(await expert.run(), "Regular Wires Module")
+        self.assertIs(defuser.session, new)
+        self.assertIs(expert.session, new)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import json
+import unittest
+from unittest import mock
+
+from game.bomb import Bomb
+from game.modules.module import ActionResult
+from game_mcp import game_server
+
+
+class GameInteractionBatchTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(game_server, "bomb", Bomb())
+        self.bomb = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_batch_stops_at_game_over(self):
+        with mock.patch.object(self.bomb.modules[0], "do_action", return_value=ActionResult.EXPLODED) as do_action:
+            result = await game_server.game_interaction_batch(json.dumps(["cut wire 1", "cut wire 2", "state"]))
+
+        self.assertEqual(json.loads(result), [game_server.BOMB_EXPLODED])
+        do_action.assert_called_once_with("cut wire 1")
+
+    async def test_invalid_batch_is_rejected(self):
+        for commands in ("not json", json.dumps("state"), json.dumps(["state", 1])):
+            with self.subTest(commands=commands):
+                self.assertEqual(await game_server.game_interaction_batch(commands), game_server.INVALID_BATCH)
+
+
+if __name__ == "__main__":
+    unittest.main()